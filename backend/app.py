@@ -1,18 +1,30 @@
 import os
-import json
-import traceback
+import sys
+import atexit
+import signal
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
-from typing import Dict, List, Optional, Any
-
-from flask import Flask, request, jsonify
+from typing import Dict, Iterator, List, NamedTuple, Optional, Any, Union
+
+import numpy as np
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+import torch
+from cachetools import TTLCache
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
 from langchain_ollama import ChatOllama
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_community.utilities import GoogleSerperAPIWrapper
 from langchain_core.tools import Tool
 from langchain_openai import ChatOpenAI
@@ -29,20 +41,95 @@ from prompt_library import (
     FINETUNE_RESPONSE_PROMPT_TEMPLATE,
     REPHRASE_PROMPT # --- FIX: Import the new rephrase prompt ---
 )
+from semantic_cache import SemanticCache, acquire_persistence_lock
+
+# Per-request chatter (agent trace, chunk dumps) is DEBUG; set VERBOSE=1 to see it.
+logging.basicConfig(
+    level=logging.DEBUG if os.environ.get("VERBOSE") else logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, so jsonify() encodes long LLM responses in Rust."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        # jsonify() goes through here: orjson's bytes become the body as-is, instead of being
+        # decoded to str by dumps() and encoded back by the response
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json"
+        )
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # --- Global RAG/Agent Components ---
 vectorstore = None
 llm = None
+LLM_MODEL_NAME = None
 embedding_model = None
 serper_search = None
 rag_components_initialized = False
-session_store = {}
+rag_components_initializing = False
+# Per-session multi-turn state, keyed by the client's X-Session-ID header. Bounded and
+# expiring so abandoned sessions don't accumulate; TTLCache is not thread-safe on its own.
+session_store = TTLCache(maxsize=10_000, ttl=1800)
+session_lock = threading.Lock()
 
 rag_agent_flow = None
 
+# Prompt | llm | parser chains, composed once in initialize_rag_components
+RELEVANCE_CHAIN = None
+AMBIGUITY_CHAIN = None
+REPHRASE_CHAIN = None
+FINETUNE_CHAIN = None
+RAG_CHAIN = None
+WEB_SYNTHESIS_CHAIN = None
+
+# Runs the vector search in the background while the request thread waits on the
+# ambiguity LLM call. Only the short search goes here, so slow LLM calls never queue on it.
+agent_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="agent")
+
+FEEDBACK_FILE_PATH = "feedback_history.jsonl"
+
+# --- Semantic Response Cache ---
+# Paraphrased repeats of an answered question are served from here without calling the LLM.
+SEMANTIC_CACHE_DIR = "semantic_cache"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+# Bounded, and entries expire so answers from since re-ingested documents age out
+SEMANTIC_CACHE_MAX_ENTRIES = 10_000
+SEMANTIC_CACHE_TTL_SECONDS = 24 * 3600
+CACHEABLE_SOURCE_LABELS = {"Direct Match", "Agent (High-Confidence RAG)", "Agent + Internal Docs"}
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+    model_name=config.EMBEDDING_MODEL_NAME
+)
+
+
+# --- Provider Credentials ---
+# Exported once at import so re-initialization never mutates os.environ while
+# request threads are running. Explicitly set environment variables take precedence.
+for _env_name, _env_value in (
+    ("OPENAI_API_KEY", config.OPENAI_API_KEY),
+    ("GOOGLE_API_KEY", config.GEMINI_API_KEY),
+    ("ANTHROPIC_API_KEY", config.CLAUDE_API_KEY),
+    ("SERPER_API_KEY", config.SERPER_API_KEY),
+):
+    if _env_value and _env_value != "Dummy to be updated":
+        os.environ.setdefault(_env_name, _env_value)
+
 
 # --- LLM Initialization Helper Function ---
 def _initialize_llm(provider: str):
@@ -50,7 +137,7 @@ def _initialize_llm(provider: str):
     if not provider:
         raise ValueError("No LLM provider specified in config.py")
 
-    print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Initializing LLM from provider: {provider}...", flush=True)
+    logger.info(f"Initializing LLM from provider: {provider}...")
 
     match provider:
         case "ollama":
@@ -62,7 +149,6 @@ def _initialize_llm(provider: str):
         case "openai":
             if not config.OPENAI_API_KEY:
                 raise ValueError("OPENAI_API_KEY not set in config.py")
-            os.environ["OPENAI_API_KEY"] = config.OPENAI_API_KEY
             return ChatOpenAI(
                 model_name=config.OPENAI_MODEL_NAME,
                 temperature=0.0
@@ -70,7 +156,6 @@ def _initialize_llm(provider: str):
         case "gemini":
             if config.GEMINI_API_KEY == "Dummy to be updated" or not config.GEMINI_API_KEY:
                 raise ValueError("GEMINI_API_KEY not set in config.py")
-            os.environ["GOOGLE_API_KEY"] = config.GEMINI_API_KEY
             return ChatGoogleGenerativeAI(
                 model=config.GEMINI_MODEL_NAME,
                 temperature=0.0
@@ -78,7 +163,6 @@ def _initialize_llm(provider: str):
         case "claude":
             if not config.CLAUDE_API_KEY:
                 raise ValueError("CLAUDE_API_KEY not set in config.py")
-            os.environ["ANTHROPIC_API_KEY"] = config.CLAUDE_API_KEY
             return ChatAnthropic(
                 model_name=config.CLAUDE_MODEL_NAME,
                 temperature=0.0
@@ -87,98 +171,161 @@ def _initialize_llm(provider: str):
             raise ValueError(f"Unsupported LLM provider: {provider}")
 
 
+# --- Web Search Wrapper ---
+# One pooled HTTPS session for all Serper calls, so searches after the first reuse a
+# keep-alive connection instead of paying a new TLS handshake each time.
+serper_http_session = requests.Session()
+serper_http_session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+class PooledGoogleSerperAPIWrapper(GoogleSerperAPIWrapper):
+    """GoogleSerperAPIWrapper that sends its requests through serper_http_session."""
+
+    def _google_serper_api_results(self, search_term: str, search_type: str = "search", **kwargs: Any) -> dict:
+        headers = {
+            "X-API-KEY": self.serper_api_key or "",
+            "Content-Type": "application/json",
+        }
+        params = {
+            "q": search_term,
+            **{key: value for key, value in kwargs.items() if value is not None},
+        }
+        response = serper_http_session.post(
+            f"https://google.serper.dev/{search_type}", headers=headers, params=params
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+# --- Session Helpers ---
+def get_session_state(session_id: str) -> dict:
+    with session_lock:
+        return session_store.get(session_id, {})
+
+def set_session_state(session_id: str, state: dict):
+    with session_lock:
+        session_store[session_id] = state
+
+def clear_session_state(session_id: str):
+    with session_lock:
+        session_store.pop(session_id, None)
+
+
+# --- Embedding Helpers ---
+def _select_embedding_device() -> str:
+    """Picks the fastest available device for the embedding model."""
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+@lru_cache(maxsize=1024)
+def _embed(query: str) -> tuple:
+    """
+    Embeds a query once and memoizes it, so the semantic cache, the high-confidence
+    trigger and the main retrieval all share a single forward pass per query.
+    """
+    return tuple(embedding_model.embed_query(query))
+
+
 # --- TOOLS for the Agent ---
-def retrieve_from_docs(query: str) -> tuple[str, list]:
+MAX_CHUNK_DISTANCE = 0.7
+# A top chunk this close to the query is returned as-is, without LLM synthesis
+DIRECT_MATCH_DISTANCE = 0.3
+
+class RetrievedChunks(NamedTuple):
+    """
+    Search results as parallel arrays rather than (doc, score) tuples, so score
+    thresholds and any future reranking features are computed vectorized with numpy.
+    """
+    documents: List[Document]
+    scores: np.ndarray
+
+def search_docs(query: str, k: int = 8, max_distance: float = MAX_CHUNK_DISTANCE) -> RetrievedChunks:
+    """
+    Runs the single vector search for a query. Its results are shared by
+    check_exact_match and retrieve_from_docs so Chroma is only queried once.
+    Chunks further than `max_distance` are dropped here, at retrieval time.
+    A failed search returns no chunks, so the agent falls back to asking for a web search.
+    """
+    try:
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(list(_embed(query)), k=k)
+    except Exception as e:
+        logger.exception(f"Error in search_docs: {e}")
+        return RetrievedChunks([], np.empty(0, dtype=np.float32))
+    scores = np.fromiter((score for _, score in results), dtype=np.float32, count=len(results))
+    keep = np.flatnonzero(scores <= max_distance)
+    return RetrievedChunks([results[i][0] for i in keep], scores[keep])
+
+def retrieve_from_docs(query: str, results: Optional[RetrievedChunks] = None) -> tuple[str, list]:
     
     """
-    Searches the db, filters chunks by a score threshold, then returns the combined content.
+    Searches the db for chunks within the score threshold, then returns the combined content.
+    If `results` from search_docs are passed in, they are reused instead of re-querying.
     """
     if not vectorstore:
         return "Error: Document database not initialized.", []
 
     try:
-        # Step 1: Retrieve a broad set of initial chunks (k=8)
-        initial_chunks = vectorstore.similarity_search_with_score(query, k=8)
-        
-        # --- NEW LOGIC: Filter out chunks with a distance score > 0.7 ---
-        filtered_chunks = []
-        for doc, score in initial_chunks:
-            if score <= 0.7:
-                filtered_chunks.append((doc, score))
+        # Step 1: Retrieve a broad set of initial chunks (k=8), already filtered to distance <= 0.7
+        filtered_chunks = results if results is not None else search_docs(query)
 
-        print(f"--- Retrieved {len(initial_chunks)} chunks, kept {len(filtered_chunks)} after filtering with score <= 0.7 ---", flush=True)
+        logger.debug("--- Retrieved %d chunks with score <= %s ---", len(filtered_chunks.documents), MAX_CHUNK_DISTANCE)
 
         # If no chunks meet the score threshold, return "not found"
-        if not filtered_chunks:
+        if not filtered_chunks.documents:
             return "No relevant documents found that meet the quality threshold.", []
         
-        # --- NEW: Print block to inspect the final chunks under consideration ---
-        print("\n" + "="*50, flush=True)
-        print(f"--- INSPECTING {len(filtered_chunks)} FINAL CHUNKS FOR CONTEXT ---", flush=True)
-        for i, (chunk_document, chunk_score) in enumerate(filtered_chunks):
-            print(f"\n--- FINAL CHUNK {i+1} ---", flush=True)
-            print(f"DISTANCE SCORE: {chunk_score:.4f}", flush=True) # Formatted for readability
-            print("CONTENT:", flush=True)
-            print(chunk_document.page_content, flush=True)
-        print("\n" + "="*50, flush=True)
-        # --- End of new print block ---
-
-        # --- FIX: Create a new list containing only the Document objects ---
-        final_document_list = [doc for doc, score in filtered_chunks]
+        # --- Debug block to inspect the final chunks under consideration ---
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- INSPECTING %d FINAL CHUNKS FOR CONTEXT ---", len(filtered_chunks.documents))
+            for i, (chunk_document, chunk_score) in enumerate(zip(*filtered_chunks)):
+                logger.debug("--- FINAL CHUNK %d ---\nDISTANCE SCORE: %.4f\nCONTENT:\n%s", i + 1, chunk_score, chunk_document.page_content)
+
+        final_document_list = filtered_chunks.documents
 
         # Step 3: Build the final context from the high-quality list of documents
-        context_text = "\n\n---\n\n".join([doc.page_content for doc in final_document_list])
-        sources = list(set([doc.metadata.get('source', 'N/A') for doc in final_document_list]))
+        context_text = "\n\n---\n\n".join(doc.page_content for doc in final_document_list)
+        # dict.fromkeys de-duplicates in one pass while keeping first-seen (rank) order
+        sources = list(dict.fromkeys(doc.metadata.get('source', 'N/A') for doc in final_document_list))
 
         return context_text, sources
     except Exception as e:
-        print(f"Error in retrieve_from_docs: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Error in retrieve_from_docs: {e}")
         return f"Error during local document retrieval: {e}", []
 
-def check_exact_match(query: str) -> Optional[tuple[str, list]]:
+def check_exact_match(query: str, results: Optional[RetrievedChunks] = None) -> Optional[tuple[str, list]]:
     """
     Performs a simple keyword-based search for a near-exact match of the query.
     This is a fast check to bypass the LLM for simple Q&A.
+    Only the top 3 of the shared search_docs `results` are inspected.
     """
     if not vectorstore:
         return None
     try:
         
-        # --- NEW LOGIC: Retrieve top 2 chunks ---
-        docs_with_score = vectorstore.similarity_search_with_score(query, k=3)
+        # --- Inspect the top 3 chunks of the shared retrieval ---
+        results = results if results is not None else search_docs(query)
+        top_documents, top_scores = results.documents[:3], results.scores[:3]
 
         # --- CODE BLOCK FOR INSPECTING THE CHUNKS ---
         
-        print("\n" + "="*50, flush=True)
-        print(f"--- INSPECTING {len(docs_with_score)} RETRIEVED CHUNKS ---", flush=True)
-        for i, (chunk_document, chunk_score) in enumerate(docs_with_score):
-            print(f"\n--- CHUNK {i+1} ---", flush=True)
-            print(f"DISTANCE SCORE: {chunk_score}", flush=True)
-            print("CONTENT:", flush=True)
-            print(chunk_document.page_content, flush=True)
-        print("\n" + "="*50, flush=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- INSPECTING %d RETRIEVED CHUNKS ---", len(top_documents))
+            for i, (chunk_document, chunk_score) in enumerate(zip(top_documents, top_scores)):
+                logger.debug("--- CHUNK %d ---\nDISTANCE SCORE: %s\nCONTENT:\n%s", i + 1, chunk_score, chunk_document.page_content)
         
         # --- END OF NEW CODE BLOCK ---
-        
-        
-        # --- NEW LOGIC: Retrieve top 3 chunks ---
-        docs_with_score = vectorstore.similarity_search_with_score(query, k=3)
-
-        # --- NEW LOGIC: Loop through the chunks and check their scores individually ---
-        for i, (doc, score) in enumerate(docs_with_score):
-            print(f"--- Exact match check: Chunk {i+1} score is {score:.4f} ---", flush=True)
-            # If any chunk has a score less than 0.5, trigger success and stop checking.
-            if score < 0.7:
-                print(f"--- Score is < 0.7. Triggering high-confidence RAG flow. ---", flush=True)
-                # This function now acts only as a trigger.
-                return "trigger_success", []
-            
-        # If the loop completes and no chunk met the condition, return None.
+
+        # If any of the top chunks has a score less than 0.7, trigger success.
+        if (top_scores < 0.7).any():
+            logger.debug("--- Score is < 0.7. Triggering high-confidence RAG flow. ---")
+            # This function now acts only as a trigger.
+            return "trigger_success", []
+
         return None
     except Exception as e:
-        print(f"Error in check_exact_match: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Error in check_exact_match: {e}")
         return None
 
 def search_web(query: str) -> str:
@@ -191,8 +338,7 @@ def search_web(query: str) -> str:
         search_results = serper_search.run(query)
         return search_results
     except Exception as e:
-        print(f"Error in search_web: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Error in search_web: {e}")
         return f"Error performing web search: {e}"
 
 def check_relevance(question: str, context: str) -> bool:
@@ -203,13 +349,11 @@ def check_relevance(question: str, context: str) -> bool:
         return False
 
     try:
-        relevance_chain = RELEVANCE_GRADER_PROMPT | llm | StrOutputParser()
-        grade = relevance_chain.invoke({"question": question, "context": context})
+        grade = RELEVANCE_CHAIN.invoke({"question": question, "context": context})
         is_relevant = grade.strip().lower().startswith("yes")
         return is_relevant
     except Exception as e:
-        print(f"Error during relevance check: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Error during relevance check: {e}")
         return False
 
 def check_for_ambiguity(query: str) -> Optional[str]:
@@ -220,16 +364,14 @@ def check_for_ambiguity(query: str) -> Optional[str]:
     if not llm:
         return None
     try:
-        ambiguity_chain = CLARIFICATION_PROMPT | llm | StrOutputParser()
-        response = ambiguity_chain.invoke({"question": query})
+        response = AMBIGUITY_CHAIN.invoke({"question": query})
         if response and response.strip().lower() == "clear":
             return "clear"
         elif response:
             return response
         return None
     except Exception as e:
-        print(f"Error checking for ambiguity: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Error checking for ambiguity: {e}")
         return None
     
 # --- NEW: Function to finalize bypassed responses ---
@@ -239,16 +381,11 @@ def finalize_exact_match_response(query: str, response_context: str) -> str:
     and directly answer the user's query, without adding new info.
     """
     if not llm:
-        print("Warning: LLM not initialized, returning raw content for exact match.", flush=True)
+        logger.warning("LLM not initialized, returning raw content for exact match.")
         return response_context
 
     try:
-         # --- FIX: Added a print statement to inspect the chunk content ---
-        print("\n" + "="*50, flush=True)
-        print("--- CHUNK CONTENT BEING SENT FOR REPHRASING ---", flush=True)
-        print(response_context, flush=True)
-        print("="*50 + "\n", flush=True)
-        # --- End of fix ---
+        logger.debug("--- CHUNK CONTENT BEING SENT FOR REPHRASING ---\n%s", response_context)
 
         # Create a dictionary with the inputs for the prompt
         prompt_inputs = {
@@ -256,173 +393,86 @@ def finalize_exact_match_response(query: str, response_context: str) -> str:
             "response_context": response_context
         }
 
-        rephrase_chain = FINETUNE_RESPONSE_PROMPT_TEMPLATE | llm | StrOutputParser()
-        final_answer = rephrase_chain.invoke(prompt_inputs)
+        final_answer = FINETUNE_CHAIN.invoke(prompt_inputs)
         return final_answer
     except Exception as e:
-        print(f"Error during final rephrasing of exact match: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Error during final rephrasing of exact match: {e}")
         # Fallback to returning the original content if rephrasing fails
         return response_context
 
 
 # --- AGENT ORCHESTRATION ---
-# def agent_decision_flow(input_query: str, session_id: str) -> tuple[str, str, list]:
+def agent_decision_flow(input_query: str, session_id: str) -> tuple[Union[str, Iterator[str]], str, list]:
     """
     Orchestrates the agent's decision-making and tool execution.
     This function handles multi-turn conversations and conditional logic.
+    Final LLM answers are returned as a token iterator from chain.stream(); agent
+    messages (clarifications, permission prompts, errors) are returned as plain strings.
     """
     try:
-        print(f"\n{'='*50}\nAGENT THOUGHT PROCESS START\n{'='*50}", flush=True)
+        logger.debug("AGENT THOUGHT PROCESS START")
 
-        session_state = session_store.get(session_id, {})
+        session_state = get_session_state(session_id)
         last_agent_action = session_state.get('last_agent_action')
         last_query = session_state.get('last_query')
 
         # Multi-turn logic for web permission
         if last_agent_action == "awaiting_web_permission":
             if input_query.lower() in ["yes", "y", "sure", "ok"]:
-                print(f"User affirmed web search. Executing web search...", flush=True)
+                logger.debug("User affirmed web search. Executing web search...")
                 tool_output = search_web(last_query)
-                final_prompt = WEB_SYNTHESIS_PROMPT_TEMPLATE
                 final_input = {"question": last_query, "search_results": tool_output}
                 source_label = "Agent + Web Search"
-                session_store.pop(session_id, None)
+                clear_session_state(session_id)
                 
-                final_response_chain = final_prompt | llm | StrOutputParser()
-                final_answer = final_response_chain.invoke(final_input)
+                final_answer = WEB_SYNTHESIS_CHAIN.stream(final_input)
                 return final_answer, source_label, []
             else:
-                session_store.pop(session_id, None)
-                return "Understood. I will not perform a web search at this time.", "Agent Response", []
-
-        # --- FIX: Re-architected the ambiguity and clarification flow ---
-        # If the agent is waiting for clarification...
-        if last_agent_action == "awaiting_clarification":
-            print(f"--- User provided clarification: '{input_query}'. Rephrasing original query. ---", flush=True)
-            # Use an LLM call to intelligently merge the original question and the new detail
-            rephrase_chain = REPHRASE_PROMPT | llm | StrOutputParser()
-            print(f"--- The last query is {last_query}")
-            print(f"--- The input query is {input_query}")
-            new_query = rephrase_chain.invoke({
-                "original_question": last_query,
-                "clarification_detail": input_query
-            })
-            print(f"--- Rephrased Query: {new_query} ---", flush=True)
-            input_query = new_query # This updated query will now be used for the rest of the flow
-            session_store.pop(session_id, None) # Clear the session state
-        else:
-            # For all other new queries, check for ambiguity first.
-            ambiguity_check = check_for_ambiguity(input_query)
-            if ambiguity_check and ambiguity_check != "clear":
-                # The question is ambiguous, so ask the user for more information
-                print(f"--- Query is ambiguous. Asking for clarification: '{ambiguity_check}' ---", flush=True)
-                session_store[session_id] = {
-                    'last_agent_action': 'awaiting_clarification',
-                    'last_query': input_query, # Store the original ambiguous query
-                }
-                return ambiguity_check, "Agent (Clarification)", []
-
-        # Main RAG flow starts here
-        exact_match_response = check_exact_match(input_query)
-        if exact_match_response:
-            content, sources = exact_match_response
-            print("--- Exact match found. Rephrasing response for coherence. ---", flush=True)
-            # Call the new function to rephrase the content
-            final_answer = finalize_exact_match_response(input_query, content)
-            # --- FIX: Return the rephrased 'final_answer', not the raw 'content' ---
-            return final_answer, "Agent (Exact Match Rephrased)", sources
-
-        tool_output, sources = retrieve_from_docs(input_query)
-        
-        local_search_successful = False
-        if "Error" not in tool_output and "No relevant documents" not in tool_output:
-            if check_relevance(input_query, tool_output):
-                local_search_successful = True
-        
-        if local_search_successful:
-            final_prompt = RAG_PROMPT_TEMPLATE
-            final_input = {"context": tool_output, "question": input_query}
-            source_label = "Agent + Internal Docs"
-            final_response_chain = final_prompt | llm | StrOutputParser()
-            final_answer = final_response_chain.invoke(final_input)
-            return final_answer, source_label, sources
-        else:
-            print(f"\n--- Fallback Triggered: Local docs insufficient, asking user for permission to search web ---", flush=True)
-            
-            session_store[session_id] = {
-                'last_agent_action': 'awaiting_web_permission',
-                'last_query': input_query
-            }
-            
-            permission_question = "I couldn't find a good answer in the available documents. Would you like me to search the web for you? (yes/no)"
-            return permission_question, "Agent (Multi-turn)", []
-
-    except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ERROR: An unhandled exception occurred in agent flow: {e}", flush=True)
-        traceback.print_exc()
-        return f"An internal agent error occurred: {e}", "System Error", []
-
-# --- AGENT ORCHESTRATION ---
-def agent_decision_flow(input_query: str, session_id: str) -> tuple[str, str, list]:
-    """
-    Orchestrates the agent's decision-making and tool execution.
-    This function handles multi-turn conversations and conditional logic.
-    """
-    try:
-        print(f"\n{'='*50}\nAGENT THOUGHT PROCESS START\n{'='*50}", flush=True)
-
-        session_state = session_store.get(session_id, {})
-        last_agent_action = session_state.get('last_agent_action')
-        last_query = session_state.get('last_query')
-
-        # Multi-turn logic for web permission
-        if last_agent_action == "awaiting_web_permission":
-            if input_query.lower() in ["yes", "y", "sure", "ok"]:
-                print(f"User affirmed web search. Executing web search...", flush=True)
-                tool_output = search_web(last_query)
-                final_prompt = WEB_SYNTHESIS_PROMPT_TEMPLATE
-                final_input = {"question": last_query, "search_results": tool_output}
-                source_label = "Agent + Web Search"
-                session_store.pop(session_id, None)
-                
-                final_response_chain = final_prompt | llm | StrOutputParser()
-                final_answer = final_response_chain.invoke(final_input)
-                return final_answer, source_label, []
-            else:
-                session_store.pop(session_id, None)
+                clear_session_state(session_id)
                 return "Understood. I will not perform a web search at this time.", "Agent Response", []
 
         # Re-architected the ambiguity and clarification flow
         if last_agent_action == "awaiting_clarification":
-            print(f"--- User provided clarification: '{input_query}'. Rephrasing original query. ---", flush=True)
-            rephrase_chain = REPHRASE_PROMPT | llm | StrOutputParser()
-            new_query = rephrase_chain.invoke({
+            logger.debug("--- User provided clarification: '%s'. Rephrasing original query. ---", input_query)
+            new_query = REPHRASE_CHAIN.invoke({
                 "original_question": last_query,
                 "clarification_detail": input_query
             })
-            print(f"--- Rephrased Query: {new_query} ---", flush=True)
+            logger.debug("--- Rephrased Query: %s ---", new_query)
             input_query = new_query
-            session_store.pop(session_id, None)
+            clear_session_state(session_id)
+            search_future = None
         else:
+            # The ambiguity LLM call is network-bound and the vector search is CPU-bound
+            # in native code, so both release the GIL and overlap cleanly.
+            search_future = agent_executor.submit(search_docs, input_query)
             ambiguity_check = check_for_ambiguity(input_query)
             if ambiguity_check and ambiguity_check != "clear":
-                print(f"--- Query is ambiguous. Asking for clarification: '{ambiguity_check}' ---", flush=True)
-                session_store[session_id] = {
+                logger.debug("--- Query is ambiguous. Asking for clarification: '%s' ---", ambiguity_check)
+                set_session_state(session_id, {
                     'last_agent_action': 'awaiting_clarification',
                     'last_query': input_query,
-                }
+                })
                 return ambiguity_check, "Agent (Clarification)", []
 
         # --- NEW HYBRID LOGIC ---
+        # A single k=8 retrieval feeds both the trigger check and the context build.
+        search_results = search_future.result() if search_future else search_docs(input_query)
+
         # First, check for a high-confidence trigger.
-        exact_match_response = check_exact_match(input_query)
+        exact_match_response = check_exact_match(input_query, search_results)
         if exact_match_response:
+            # A near-identical chunk already IS the answer: skip context building and the LLM call.
+            top_document, top_score = search_results.documents[0], search_results.scores[0]
+            if top_score < DIRECT_MATCH_DISTANCE:
+                logger.debug("--- Top chunk score %.4f < %s. Returning direct match. ---", top_score, DIRECT_MATCH_DISTANCE)
+                return top_document.page_content.strip(), "Direct Match", [top_document.metadata.get('source', 'N/A')]
+
             # The trigger was successful. Now, gather a WIDER context to formulate a rich answer.
-            print("--- High-confidence trigger found. Gathering broader context for a comprehensive answer. ---", flush=True)
+            logger.debug("--- High-confidence trigger found. Gathering broader context for a comprehensive answer. ---")
             
-            # 1. Retrieve the top 4 chunks using the main retrieval function.
-            context_text, sources = retrieve_from_docs(input_query)
+            # 1. Build the context from the already-retrieved chunks.
+            context_text, sources = retrieve_from_docs(input_query, search_results)
             
             # 2. Check if the retrieved context is valid.
             if "Error" in context_text or "No relevant documents" in context_text:
@@ -430,18 +480,16 @@ def agent_decision_flow(input_query: str, session_id: str) -> tuple[str, str, li
                  return "I found a potential match but was unable to retrieve the full context.", "System Error", []
 
             # 3. Use the main RAG prompt to synthesize an answer from the multi-chunk context.
-            final_prompt = RAG_PROMPT_TEMPLATE
             final_input = {"context": context_text, "question": input_query}
             source_label = "Agent (High-Confidence RAG)" # New label for this path
             
-            final_response_chain = final_prompt | llm | StrOutputParser()
-            final_answer = final_response_chain.invoke(final_input)
+            final_answer = RAG_CHAIN.stream(final_input)
             
             return final_answer, source_label, sources
 
         # --- This is now the fallback path if the high-confidence trigger is NOT met ---
-        print("--- No high-confidence trigger. Proceeding with standard RAG flow. ---", flush=True)
-        tool_output, sources = retrieve_from_docs(input_query)
+        logger.debug("--- No high-confidence trigger. Proceeding with standard RAG flow. ---")
+        tool_output, sources = retrieve_from_docs(input_query, search_results)
         
         local_search_successful = False
         if "Error" not in tool_output and "No relevant documents" not in tool_output:
@@ -449,113 +497,185 @@ def agent_decision_flow(input_query: str, session_id: str) -> tuple[str, str, li
                 local_search_successful = True
         
         if local_search_successful:
-            final_prompt = RAG_PROMPT_TEMPLATE
             final_input = {"context": tool_output, "question": input_query}
             source_label = "Agent + Internal Docs"
-            final_response_chain = final_prompt | llm | StrOutputParser()
-            final_answer = final_response_chain.invoke(final_input)
+            final_answer = RAG_CHAIN.stream(final_input)
             return final_answer, source_label, sources
         else:
-            print(f"\n--- Fallback Triggered: Local docs insufficient, asking user for permission to search web ---", flush=True)
+            logger.debug("--- Fallback Triggered: Local docs insufficient, asking user for permission to search web ---")
             
-            session_store[session_id] = {
+            set_session_state(session_id, {
                 'last_agent_action': 'awaiting_web_permission',
                 'last_query': input_query
-            }
+            })
             
             permission_question = "I couldn't find a good answer in the available documents. Would you like me to search the web for you? (yes/no)"
             return permission_question, "Agent (Multi-turn)", []
 
     except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ERROR: An unhandled exception occurred in agent flow: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"An unhandled exception occurred in agent flow: {e}")
         return f"An internal agent error occurred: {e}", "System Error", []
 
 def initialize_rag_components():
     """Initializes all necessary RAG/Agent components."""
-    global vectorstore, llm, embedding_model, serper_search, rag_agent_flow, rag_components_initialized
+    global vectorstore, llm, embedding_model, serper_search, rag_agent_flow, rag_components_initialized, LLM_MODEL_NAME
+    global RELEVANCE_CHAIN, AMBIGUITY_CHAIN, REPHRASE_CHAIN, FINETUNE_CHAIN, RAG_CHAIN, WEB_SYNTHESIS_CHAIN
 
-    print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Initializing RAG/Agent components...", flush=True)
+    logger.info("Initializing RAG/Agent components...")
     
     try:
         llm = _initialize_llm(config.ACTIVE_LLM_PROVIDER)
-        if hasattr(llm, 'model_name'):
-             llm_model_name = llm.model_name
-        else:
-            llm_model_name = config.OLLAMA_MODEL_NAME
+        # ChatOpenAI/ChatAnthropic expose model_name; ChatOllama/ChatGoogleGenerativeAI expose model
+        LLM_MODEL_NAME = getattr(llm, 'model_name', None) or getattr(llm, 'model', None)
 
         test_response = llm.invoke("Hello.")
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - LLM '{llm_model_name}' connected. Test response: '{test_response.content[:50]}...'", flush=True)
+        logger.info(f"LLM '{LLM_MODEL_NAME}' connected. Test response: '{test_response.content[:50]}...'")
     except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ERROR: Could not initialize LLM from provider: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Could not initialize LLM from provider: {e}")
         return False
         
     try:
-        model_kwargs = {'device': 'cpu'}
-        encode_kwargs = {'normalize_embeddings': True}
+        device = _select_embedding_device()
+        model_kwargs = {'device': device}
+        if device != 'cpu':
+            # Half precision on GPU/MPS; CPU kernels are slower in fp16, so it stays fp32 there.
+            model_kwargs['model_kwargs'] = {'torch_dtype': torch.float16}
+        encode_kwargs = {'batch_size': 64, 'normalize_embeddings': True}
         embedding_model = HuggingFaceEmbeddings(
             model_name=config.EMBEDDING_MODEL_NAME,
             model_kwargs=model_kwargs,
             encode_kwargs=encode_kwargs
         )
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Embedding model '{config.EMBEDDING_MODEL_NAME}' loaded successfully.", flush=True)
+        # One dummy forward pass so Torch kernel selection/autotuning isn't paid by the first user query
+        embedding_model.embed_query("warmup")
+        logger.info(f"Embedding model '{config.EMBEDDING_MODEL_NAME}' loaded successfully on '{device}'.")
     except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ERROR: Could not load embedding model: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Could not load embedding model: {e}")
         return False
 
     try:
         if not os.path.exists(config.CHROMA_PERSIST_DIR):
-            print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - WARNING: ChromaDB persistence directory not found: {config.CHROMA_PERSIST_DIR}. Please run the ingestion pipeline first.", flush=True)
+            logger.warning(f"ChromaDB persistence directory not found: {config.CHROMA_PERSIST_DIR}. Please run the ingestion pipeline first.")
             return False
         vectorstore = Chroma(
             persist_directory=config.CHROMA_PERSIST_DIR,
             embedding_function=embedding_model,
             collection_name=config.CHROMA_COLLECTION_NAME
         )
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ChromaDB collection '{config.CHROMA_COLLECTION_NAME}' loaded.", flush=True)
+        logger.info(f"ChromaDB collection '{config.CHROMA_COLLECTION_NAME}' loaded.")
         if vectorstore._collection.count() == 0:
-            print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - WARNING: ChromaDB collection is empty. RAG will not find internal documents.", flush=True)
+            logger.warning("ChromaDB collection is empty. RAG will not find internal documents.")
+        else:
+            # Loads the HNSW index into memory ahead of the first query
+            vectorstore.similarity_search("warmup", k=1)
     except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ERROR: Could not initialize ChromaDB: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Could not initialize ChromaDB: {e}")
         return False
 
     try:
         if not config.SERPER_API_KEY:
-            print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - WARNING: SERPER_API_KEY not set in config.py. Web search will be disabled.", flush=True)
+            logger.warning("SERPER_API_KEY not set in config.py. Web search will be disabled.")
             serper_search = None
         else:
-            os.environ["SERPER_API_KEY"] = config.SERPER_API_KEY
-            serper_search = GoogleSerperAPIWrapper()
-            print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Serper API Wrapper initialized.", flush=True)
+            serper_search = PooledGoogleSerperAPIWrapper()
+            logger.info("Serper API Wrapper initialized.")
     except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %M:%S')} - ERROR: Could not initialize Serper API Wrapper: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"Could not initialize Serper API Wrapper: {e}")
         return False
 
+    # Compose every chain once instead of rebuilding the Runnable graph on each request
+    output_parser = StrOutputParser()
+    RELEVANCE_CHAIN = RELEVANCE_GRADER_PROMPT | llm | output_parser
+    AMBIGUITY_CHAIN = CLARIFICATION_PROMPT | llm | output_parser
+    REPHRASE_CHAIN = REPHRASE_PROMPT | llm | output_parser
+    FINETUNE_CHAIN = FINETUNE_RESPONSE_PROMPT_TEMPLATE | llm | output_parser
+    RAG_CHAIN = RAG_PROMPT_TEMPLATE | llm | output_parser
+    WEB_SYNTHESIS_CHAIN = WEB_SYNTHESIS_PROMPT_TEMPLATE | llm | output_parser
+
+    if semantic_cache.load(SEMANTIC_CACHE_DIR):
+        logger.info(f"Semantic cache loaded with {len(semantic_cache)} entries.")
+    # Every gunicorn worker loads the cache, but only the one holding the lock writes it back
+    if acquire_persistence_lock(SEMANTIC_CACHE_DIR):
+        atexit.register(semantic_cache.save, SEMANTIC_CACHE_DIR)
+
     global rag_agent_flow
     rag_agent_flow = agent_decision_flow
     
-    print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Agent-driven RAG flow constructed successfully.", flush=True)
+    logger.info("Agent-driven RAG flow constructed successfully.")
     rag_components_initialized = True
     return True
 
 
+def initialize_rag_components_in_background() -> threading.Thread:
+    """Runs initialize_rag_components on a daemon thread so the server can start serving /health immediately."""
+    global rag_components_initializing
+    rag_components_initializing = True
+
+    def _run():
+        global rag_components_initializing
+        try:
+            initialize_rag_components()
+        finally:
+            rag_components_initializing = False
+
+    thread = threading.Thread(target=_run, name="rag-init", daemon=True)
+    thread.start()
+    return thread
+
+
 # --- Flask Routes ---
+def _sse(event: str, payload: dict) -> str:
+    """Formats one Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {orjson.dumps(payload).decode()}\n\n"
+
+def _stream_response(user_query: str, llm_response: Union[str, Iterator[str]], source_label: str, sources: list, query_embedding=None):
+    """
+    Yields SSE frames: a 'meta' frame with the source attribution, one 'token' frame
+    per generated chunk, then 'done'. The complete answer is cached once streaming ends.
+    """
+    yield _sse("meta", {"query": user_query, "source": source_label, "sources": sources})
+    if isinstance(llm_response, str):
+        llm_response = [llm_response]
+    tokens = []
+    try:
+        for token in llm_response:
+            tokens.append(token)
+            yield _sse("token", {"token": token})
+    except Exception as e:
+        logger.exception(f"Streaming failed: {e}")
+        yield _sse("error", {"error": f"Internal server error: {str(e)}"})
+        return
+    full_response = "".join(tokens)
+    if query_embedding is not None and source_label in CACHEABLE_SOURCE_LABELS:
+        semantic_cache.add(user_query, query_embedding, (full_response, source_label, sources))
+    logger.info(f"Final streamed response for '{user_query}': '{full_response[:100]}...' (Source: {source_label})")
+    yield _sse("done", {})
+
 @app.route('/api/query', methods=['POST'])
 def handle_query():
-    """Handles incoming user queries by performing RAG."""
+    """
+    Handles incoming user queries by performing RAG.
+    Clients sending 'Accept: text/event-stream' receive the answer as SSE frames
+    while it is generated; others receive the complete JSON body.
+    """
     try:
+        wants_stream = 'text/event-stream' in request.headers.get('Accept', '')
         data = request.get_json()
         if not data or 'query' not in data:
             return jsonify({'error': 'Missing query field in request body'}), 400
         user_query = data['query']
-        session_id = request.remote_addr # Using IP for session, consider a more robust method for production
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Received query: '{user_query}' for session: {session_id}", flush=True)
+        # The frontend sends a per-tab X-Session-ID; fall back to the client IP for other callers
+        session_id = request.headers.get('X-Session-ID') or request.remote_addr
+        logger.info(f"Received query: '{user_query}' for session: {session_id}")
 
         if not rag_components_initialized or not rag_agent_flow:
+            if rag_components_initializing:
+                return jsonify({
+                    "response": "Backend is still starting up. Please retry in a few seconds.",
+                    "query": user_query,
+                    "source": "System",
+                    "sources": []
+                }), 503, {'Retry-After': '5'}
             return jsonify({
                 "response": "Backend not fully initialized. Check server logs.",
                 "query": user_query,
@@ -563,9 +683,37 @@ def handle_query():
                 "sources": []
             }), 500
 
+        # Only fresh questions are cacheable; follow-ups ("yes", clarifications) depend on session state.
+        query_embedding = None
+        if not get_session_state(session_id):
+            query_embedding = _embed(user_query)
+            cached = semantic_cache.lookup(user_query, query_embedding)
+            if cached:
+                llm_response, source_label, sources = cached
+                logger.info(f"Semantic cache hit for '{user_query}' (Source: {source_label})")
+                if wants_stream:
+                    return Response(_stream_response(user_query, llm_response, source_label, sources), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+                return jsonify({
+                    'response': llm_response.strip(),
+                    'query': user_query,
+                    'source': source_label,
+                    'sources': sources
+                }), 200
+
+        # Each request runs on its own server thread (threaded dev server, gunicorn gthread
+        # workers), so the blocking agent chains never hold up other requests.
         llm_response, source_label, sources = rag_agent_flow(user_query, session_id)
 
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Final generated response for '{user_query}': '{llm_response[:100]}...' (Source: {source_label})", flush=True)
+        if wants_stream:
+            return Response(_stream_response(user_query, llm_response, source_label, sources, query_embedding), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+        if not isinstance(llm_response, str):
+            llm_response = "".join(llm_response)
+
+        if query_embedding is not None and source_label in CACHEABLE_SOURCE_LABELS:
+            semantic_cache.add(user_query, query_embedding, (llm_response, source_label, sources))
+
+        logger.info(f"Final generated response for '{user_query}': '{llm_response[:100]}...' (Source: {source_label})")
 
         return jsonify({
             'response': llm_response.strip(),
@@ -575,8 +723,7 @@ def handle_query():
         }), 200
 
     except Exception as e:
-        print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - ERROR: An unexpected error occurred: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"An unexpected error occurred: {e}")
         return jsonify({
             'error': f'Internal server error: {str(e)}',
             'query': request.get_json().get('query', 'N/A'),
@@ -586,7 +733,7 @@ def handle_query():
 
 @app.route('/api/feedback', methods=['POST'])
 def handle_feedback():
-    """Handles feedback from the user and stores it in a JSON file."""
+    """Handles feedback from the user and appends it to a JSON Lines file."""
     try:
         data = request.get_json()
         if not data or 'query' not in data or 'response' not in data or 'liked' not in data:
@@ -600,24 +747,14 @@ def handle_feedback():
             'liked': data['liked']
         }
 
-        feedback_file_path = "feedback_history.json"
-        
-        if os.path.exists(feedback_file_path):
-            with open(feedback_file_path, 'r') as f:
-                history = json.load(f)
-        else:
-            history = []
-
-        history.append(feedback_data)
-        
-        with open(feedback_file_path, 'w') as f:
-            json.dump(history, f, indent=4)
+        # JSON Lines: one O(1) append per event instead of rewriting the whole history.
+        with open(FEEDBACK_FILE_PATH, 'ab') as f:
+            f.write(orjson.dumps(feedback_data) + b'\n')
 
         return jsonify({'message': 'Feedback received successfully'}), 200
     
     except Exception as e:
-        print(f"ERROR: An unexpected error occurred while saving feedback: {e}", flush=True)
-        traceback.print_exc()
+        logger.exception(f"An unexpected error occurred while saving feedback: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
@@ -626,7 +763,10 @@ def health_check():
     """Health check endpoint for the Flask application."""
     status = 'healthy'
     message = 'Query Responder RAG API is running.'
-    if not rag_components_initialized:
+    if rag_components_initializing:
+        status = 'initializing'
+        message = 'RAG/Agent components are still loading.'
+    elif not rag_components_initialized:
         status = 'degraded'
         message = 'RAG/Agent components not initialized. Check backend logs for details.'
     return jsonify({
@@ -649,6 +789,12 @@ def root():
     }), 200
 
 if __name__ == '__main__':
-    print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Starting Query Responder RAG API...", flush=True)
-    initialize_rag_components()
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    logger.info("Starting Query Responder RAG API...")
+    # start-app.sh stops the backend with SIGTERM, which by default kills the process without
+    # running atexit handlers; exiting normally instead lets the semantic cache be saved.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    initialize_rag_components_in_background()
+    # No debug=True: the reloader would load the embedding model, ChromaDB and LLM twice.
+    app.run(host='0.0.0.0', port=5001, threaded=True)
+# Under gunicorn, gunicorn.conf.py initializes the components in each worker after it is
+# forked: CUDA contexts and ChromaDB's SQLite connection cannot be shared across a fork.
@@ -0,0 +1,32 @@
+# backend/convert_feedback_history.py
+"""
+One-shot converter from the old feedback_history.json (a single JSON array)
+to the feedback_history.jsonl format now appended to by /api/feedback.
+
+Usage: python convert_feedback_history.py [input.json] [output.jsonl]
+"""
+
+import os
+import sys
+import json
+
+
+def convert(json_path: str = "feedback_history.json", jsonl_path: str = "feedback_history.jsonl") -> int:
+    """Appends every entry of the JSON array to the JSONL file. Returns the number of entries."""
+    if not os.path.exists(json_path):
+        print(f"Nothing to convert: '{json_path}' not found.")
+        return 0
+
+    with open(json_path, 'r') as f:
+        history = json.load(f)
+
+    with open(jsonl_path, 'a') as f:
+        for entry in history:
+            f.write(json.dumps(entry) + '\n')
+
+    print(f"Converted {len(history)} feedback entries from '{json_path}' to '{jsonl_path}'.")
+    return len(history)
+
+
+if __name__ == "__main__":
+    convert(*sys.argv[1:3])
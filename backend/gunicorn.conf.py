@@ -0,0 +1,16 @@
+# backend/gunicorn.conf.py
+
+wsgi_app = "app:app"
+bind = "0.0.0.0:5001"
+
+# Threaded workers: a query holds its thread for the whole LLM generation, so
+# concurrency comes from threads rather than from more (model-loading) processes.
+workers = 4
+worker_class = "gthread"
+threads = 16
+
+
+def post_worker_init(worker):
+    """Loads the models and opens ChromaDB inside each worker, after it was forked."""
+    from app import initialize_rag_components_in_background
+    initialize_rag_components_in_background()
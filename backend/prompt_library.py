@@ -1,7 +1,10 @@
 # backend/prompt_library.py
 
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 
+# System prompts are SystemMessage objects, not ("system", text) tuples, so they are not re-formatted on every call.
+
 # --- RAG Prompts (Existing) ---
 
 # This prompt is used for the standard RAG chain.
@@ -12,7 +15,7 @@ You are a helpful AI assistant. Use ONLY the following provided context to answe
 
 # We can store the full prompt template here.
 RAG_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
-    ("system", RAG_SYSTEM_PROMPT),
+    SystemMessage(content=RAG_SYSTEM_PROMPT),
     ("human", "Context: {context}\n\nQuestion: {question}")
 ])
 
@@ -39,7 +42,7 @@ AGENT_TOOL_ROUTER_PROMPT = PromptTemplate.from_template(
 
 # This prompt is used to synthesize an answer from web search results.
 WEB_SYNTHESIS_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
-    ("system", """You are a helpful AI assistant tasked with summarizing web search results to answer a user's question.
+    SystemMessage(content="""You are a helpful AI assistant tasked with summarizing web search results to answer a user's question.
     Synthesize the information from the provided search results to answer the question clearly and concisely.
     Cite the sources if appropriate. If the search results do not contain enough information to answer, state that.
     Do NOT make up information."""),
@@ -48,7 +51,7 @@ WEB_SYNTHESIS_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
 
 # This prompt is used by a new agentic step to check if retrieved documents are relevant.
 RELEVANCE_GRADER_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """You are a relevance grader. Your task is to determine if a given context is relevant to a user's question.
+    SystemMessage(content="""You are a relevance grader. Your task is to determine if a given context is relevant to a user's question.
     The context is considered relevant ONLY if it contains specific information that can be used to directly and confidently answer the question.
     If the context contains keywords but no specific, factual information to form an answer, respond with 'no'.
     Do not be fooled by contexts that are from a similar general subject but do not contain the specific answer. For example, if the question is about 'Topic A' and the context is about 'Related Topic B', the context is not relevant. If the question asks about a specific entity and the context talks about a different entity (even if the topic is the same), the context is not relevant.
@@ -62,7 +65,7 @@ RELEVANCE_GRADER_PROMPT = ChatPromptTemplate.from_messages([
 
 # Step 1: Detect ambiguity
 CLARIFICATION_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """
+    SystemMessage(content="""
 You are an AI assistant that checks user questions for ambiguity before sending them to a search or knowledge system.
 
 Your task:
@@ -92,7 +95,7 @@ Your response: clear
 # --- FIX: Added a new prompt to intelligently rephrase the user's query after clarification ---
 # Step 2: Rephrase with provided clarification
 REPHRASE_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """
+    SystemMessage(content="""
 You are a query rephraser.
 Your task is to rewrite the 'Original Question' by seamlessly integrating the user's 'Clarification Detail'.
 The goal is to create a new, complete, and unambiguous question that can be answered on its own.
@@ -113,7 +116,9 @@ Rewritten Question: What are InnovateSoft Solutions' key differentiators?
 
 
 # --- Prompt Template for rephrasing exact matches ---
-FINETUNE_RESPONSE_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
+# A single human turn, so a plain PromptTemplate: formatting is a str.format, and chat models
+# receive the result as one human message, same as the former one-message ChatPromptTemplate.
+FINETUNE_RESPONSE_PROMPT_TEMPLATE = PromptTemplate.from_template(
     """
 You are a rephrasing assistant. Your task is to rewrite the 'Retrieved Content' to make it a direct and coherent answer to the 'User's Question'.
 Strictly use only the information available in the 'Retrieved Content'.
@@ -126,4 +131,4 @@ Retrieved Content: {response_context}
 
 Rephrased Answer:
 """
-])
\ No newline at end of file
+)
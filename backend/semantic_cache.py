@@ -0,0 +1,227 @@
+# backend/semantic_cache.py
+
+import os
+import json
+import time
+import bisect
+import hashlib
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:  # Unsupported CPU or package not installed: fall back to numpy
+    simsimd = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# A cached entry is the same triple returned by agent_decision_flow:
+# (response, source_label, sources)
+CacheEntry = Tuple[str, str, list]
+
+# Held open for the life of the process once acquire_persistence_lock succeeds
+_persistence_lock_file = None
+
+
+def cosine_similarities(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of a single query vector against every row of `matrix`.
+    Uses SimSIMD's AVX2/AVX-512/NEON kernels when available, otherwise numpy.
+    """
+    query = np.ascontiguousarray(query, dtype=np.float32)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if simsimd is not None:
+        distances = np.asarray(simsimd.cdist(query.reshape(1, -1), matrix, metric="cosine"), dtype=np.float32)
+        return 1.0 - distances.reshape(-1)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    return (matrix @ query) / np.where(norms > 0, norms, 1.0)
+
+
+def acquire_persistence_lock(directory: str) -> bool:
+    """
+    Takes an exclusive, process-lifetime lock on the cache directory. Only the process
+    holding it persists the cache, so several server workers never write the files at
+    the same time. The lock is released by the OS when the process exits.
+    """
+    global _persistence_lock_file
+    if fcntl is None:  # Windows: only the single-process development server runs there
+        return True
+    os.makedirs(directory, exist_ok=True)
+    lock_file = open(os.path.join(directory, ".persist.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _persistence_lock_file = lock_file
+    return True
+
+
+class SemanticCache:
+    """
+    In-process semantic response cache.
+
+    Lookups first try an exact hash of the normalized query text, then fall back
+    to a cosine-similarity scan over the stored (normalized) query embeddings.
+    Embeddings live in a preallocated float32 buffer that doubles when full, so
+    appending a new row is amortized O(1).
+
+    Entries expire after `ttl_seconds`, so answers built from documents that were
+    since re-ingested are not served forever, and at most `max_entries` are kept:
+    when full, expired and then the oldest entries are evicted.
+
+    The saved cache records `model_name`, and one saved under a different embedding
+    model (or dimension) is discarded on load instead of being compared against.
+    """
+
+    def __init__(self, threshold: float = 0.95, initial_capacity: int = 256,
+                 max_entries: int = 10_000, ttl_seconds: float = 24 * 3600, model_name: str = ""):
+        self.threshold = threshold
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self._entries: List[CacheEntry] = []
+        # Per-row query hash and insertion time, parallel to the matrix rows
+        self._hashes: List[str] = []
+        self._timestamps: List[float] = []
+        self._hash_index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _hash_query(query: str) -> str:
+        return hashlib.sha256(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _ensure_capacity(self, dim: int):
+        if self._matrix is None:
+            self._matrix = np.empty((self._initial_capacity, dim), dtype=np.float32)
+        elif self._size == self._matrix.shape[0]:
+            grown = np.empty((self._matrix.shape[0] * 2, dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+
+    def _evict(self, keep: int):
+        """Drops expired rows, and the oldest rows beyond `keep`. Caller holds the lock."""
+        # Rows are appended in time order, so everything to evict is a prefix
+        expired = bisect.bisect_left(self._timestamps, time.time() - self.ttl_seconds)
+        drop = max(expired, self._size - keep)
+        if drop <= 0:
+            return
+        self._size -= drop
+        self._matrix[:self._size] = self._matrix[drop:drop + self._size]
+        del self._entries[:drop], self._hashes[:drop], self._timestamps[:drop]
+        self._hash_index = {query_hash: i for i, query_hash in enumerate(self._hashes)}
+
+    def lookup(self, query: str, query_embedding) -> Optional[CacheEntry]:
+        """Returns the cached entry for an identical or paraphrased query, or None."""
+        with self._lock:
+            if self._size == 0:
+                return None
+            # Expired rows sit in the prefix before this index
+            first_fresh = bisect.bisect_left(self._timestamps, time.time() - self.ttl_seconds)
+
+            index = self._hash_index.get(self._hash_query(query))
+            if index is not None and index >= first_fresh:
+                return self._entries[index]
+
+            if first_fresh == self._size:
+                return None
+            q = self._normalize(query_embedding)
+            sims = cosine_similarities(q, self._matrix[first_fresh:self._size])
+            best = int(np.argmax(sims))
+            if sims[best] > self.threshold:
+                return self._entries[first_fresh + best]
+            return None
+
+    def add(self, query: str, query_embedding, entry: CacheEntry):
+        """Stores a response triple against the query's normalized embedding."""
+        q = self._normalize(query_embedding)
+        query_hash = self._hash_query(query)
+        with self._lock:
+            if self._size >= self.max_entries:
+                # Free 10% at once so eviction is not repeated on every following add
+                self._evict(keep=self.max_entries - self.max_entries // 10)
+            self._ensure_capacity(q.shape[0])
+            self._matrix[self._size] = q
+            self._entries.append(tuple(entry))
+            self._hashes.append(query_hash)
+            self._timestamps.append(time.time())
+            self._hash_index[query_hash] = self._size
+            self._size += 1
+
+    def save(self, directory: str):
+        """
+        Persists the cache to disk as embeddings.npy + entries.json.
+        Both files are written under temporary names and then renamed into place,
+        so a reader never sees a half-written file.
+        """
+        with self._lock:
+            if self._size == 0:
+                return
+            os.makedirs(directory, exist_ok=True)
+            matrix_path = os.path.join(directory, "embeddings.npy")
+            entries_path = os.path.join(directory, "entries.json")
+            with open(matrix_path + ".tmp", "wb") as f:
+                np.save(f, self._matrix[:self._size])
+            with open(entries_path + ".tmp", "w") as f:
+                json.dump({
+                    "model_name": self.model_name,
+                    "dim": int(self._matrix.shape[1]),
+                    "entries": [list(entry) for entry in self._entries],
+                    "hashes": self._hashes,
+                    "timestamps": self._timestamps,
+                }, f)
+            os.replace(matrix_path + ".tmp", matrix_path)
+            os.replace(entries_path + ".tmp", entries_path)
+
+    def load(self, directory: str) -> bool:
+        """
+        Loads a previously saved cache. Returns False if nothing was found, the files are
+        unreadable or do not belong together, or they were written for another embedding
+        model, in which case it starts empty.
+        """
+        matrix_path = os.path.join(directory, "embeddings.npy")
+        entries_path = os.path.join(directory, "entries.json")
+        if not (os.path.exists(matrix_path) and os.path.exists(entries_path)):
+            return False
+
+        try:
+            matrix = np.load(matrix_path).astype(np.float32)
+            with open(entries_path, "r") as f:
+                data = json.load(f)
+            model_name, dim = data["model_name"], data["dim"]
+            entries, hashes, timestamps = data["entries"], data["hashes"], data["timestamps"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if matrix.ndim != 2 or not (matrix.shape[0] == len(entries) == len(hashes) == len(timestamps)):
+            return False
+        # Vectors from another model are meaningless against, or incompatible with, new queries
+        if model_name != self.model_name or matrix.shape[1] != dim:
+            return False
+
+        with self._lock:
+            self._size = matrix.shape[0]
+            self._matrix = np.empty((max(self._initial_capacity, self._size * 2), matrix.shape[1]), dtype=np.float32)
+            self._matrix[:self._size] = matrix
+            self._entries = [tuple(entry) for entry in entries]
+            self._hashes = list(hashes)
+            self._timestamps = [float(timestamp) for timestamp in timestamps]
+            self._hash_index = {query_hash: i for i, query_hash in enumerate(self._hashes)}
+            self._evict(keep=self.max_entries)
+        return True
@@ -41,28 +41,46 @@ function App() {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          Accept: "text/event-stream",
           "X-Session-ID": sessionId,
         },
         body: JSON.stringify({ query }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
-      const responseText = data.response || "No response received";
-      const responseSources = data.sources || [];
-      // --- FIX: Capture the 'source' from the backend response ---
-      const responseSource = data.source || "Unknown";
-
-      // Simulate typing for the response
-      let typedText = "";
-      for (const char of responseText) {
-        typedText += char;
-        setCurrentTypingResponse(typedText);
-        await new Promise((resolve) => setTimeout(resolve, 20));
+      // --- Read the Server-Sent Events stream and render tokens as they arrive ---
+      let responseText = "";
+      let responseSources: string[] = [];
+      let responseSource = "Unknown";
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop() || "";
+        for (const frame of frames) {
+          const event = frame.match(/^event: (.*)$/m)?.[1];
+          const data = frame.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+          if (event === "meta") {
+            responseSources = payload.sources || [];
+            responseSource = payload.source || "Unknown";
+          } else if (event === "token") {
+            responseText += payload.token;
+            setCurrentTypingResponse(responseText);
+          } else if (event === "error") {
+            throw new Error(payload.error);
+          }
+        }
       }
+      responseText = responseText.trim() || "No response received";
 
       setConversationHistory((prev) => {
         const updatedHistory = [...prev];
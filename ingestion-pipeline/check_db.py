@@ -28,10 +28,11 @@ def check_chroma_db():
     print("Found collections:")
     for col in collections:
         print(f"- {col.name}")
+    existing_names = {col.name for col in collections}
 
     # 2. Get the specific collection you're using for documents
     collection_name = config.CHROMA_COLLECTION_NAME
-    if collection_name not in [col.name for col in collections]:
+    if collection_name not in existing_names:
         print(f"\nCollection '{collection_name}' not found.")
         print("Please check config.CHROMA_COLLECTION_NAME or run the ingestion script.")
         return
@@ -48,12 +49,12 @@ def check_chroma_db():
         return
 
     # 4. Peek at some items (get the first few without filtering)
-    print("\n--- Peeking at first 5 items (IDs, Documents, Metadatas, Embeddings) ---")
-    # include=['documents', 'metadatas', 'embeddings'] fetches the actual content, metadata, and vectors
-    # By default, it only returns IDs.
+    print("\n--- Peeking at first 5 items (IDs, Documents, Metadatas) ---")
+    # peek() always ships the embedding vectors too; get() with an explicit include
+    # fetches only the content and metadata, which is all we print.
     try:
-        peek_results = collection.peek(limit=5)
-        # ChromaDB results are returned as a dictionary with 'ids', 'embeddings', 'documents', 'metadatas'
+        peek_results = collection.get(limit=5, include=['documents', 'metadatas'])
+        # ChromaDB results are returned as a dictionary with 'ids', 'documents', 'metadatas'
         # Check if 'documents' and 'metadatas' keys exist and are not None before accessing.
         if peek_results and peek_results['ids']:
             for i, chunk_id in enumerate(peek_results['ids']):
@@ -62,8 +63,6 @@ def check_chroma_db():
                 pprint(peek_results['documents'][i][:200] + "..." if peek_results['documents'][i] and len(peek_results['documents'][i]) > 200 else peek_results['documents'][i]) # Print first 200 chars
                 print("\nMetadata:")
                 pprint(peek_results['metadatas'][i])
-                print(f"\nEmbedding (first 5 values, shape {len(peek_results['embeddings'][i])}):")
-                print(peek_results['embeddings'][i][:5])
         else:
             print("No items to peek at or data missing.")
     except Exception as e:
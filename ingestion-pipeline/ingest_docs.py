@@ -1,13 +1,16 @@
 import os
 import re # --- FIX: Import the regular expression module ---
 import hashlib
+import logging
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 from datetime import datetime
-from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import chromadb
+import torch
 from langchain_core.documents import Document # Import Document class
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
@@ -19,13 +22,30 @@ from langchain_community.document_loaders import (
     CSVLoader,
     UnstructuredImageLoader
 )
-from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 
 from tqdm import tqdm
 
+try:
+    import blake3
+except ImportError:  # Fall back to hashlib.sha256 (SHA-NI accelerated on OpenSSL 1.1.1+)
+    blake3 = None
+
 import config
 
+# Let the Rust fast tokenizer batch-tokenize on all cores. On a first run the model is only
+# loaded after the loader pool has shut down, but a later ingest_documents() call in the same
+# process forks its loaders after the tokenizer has run; see _init_loader_process.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+# Per-file chatter is DEBUG so large runs are not throttled by stdout; set VERBOSE=1 to see it.
+logging.basicConfig(
+    level=logging.DEBUG if os.environ.get("VERBOSE") else logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
 LOADER_MAPPING = {
     "PyPDFLoader": PyPDFLoader,
     "UnstructuredWordDocumentLoader": UnstructuredWordDocumentLoader,
@@ -36,10 +56,111 @@ LOADER_MAPPING = {
     "UnstructuredImageLoader": UnstructuredImageLoader,
 }
 
+# Precomputed chunks are written to ChromaDB in batches of up to this size, across files.
+# The client's own maximum batch size caps it further.
+UPSERT_BATCH = 5000
+
+# Cache lookups are split so one query stays under SQLite's bound-parameter limit
+CACHE_LOOKUP_BATCH = 900
+
+# Encoder batch size per device: GPUs need large batches to saturate, CPUs gain little past 32
+ENCODE_BATCH_SIZES = {"cuda": 256, "mps": 256, "cpu": 32}
+
+# Cached embeddings are stored at half precision: half the disk and I/O, with retrieval
+# quality unchanged for normalized sentence embeddings. ChromaDB itself only stores float32.
+EMBEDDING_CACHE_DTYPE = np.float16
+
+# Extension -> loader name with the extensions lower-cased once, and the same keys as a set
+# for O(1) membership tests during the scan
+SUPPORTED_FILE_TYPES = {ext.lower(): loader_name for ext, loader_name in config.SUPPORTED_FILE_TYPES.items()}
+SUPPORTED_EXTENSIONS = frozenset(SUPPORTED_FILE_TYPES)
+
+# Files are hashed in 1 MiB reads to amortize per-call Python overhead
+HASH_READ_SIZE = 1 << 20
+
+# Loaded once per process by get_embeddings()
+_embedding_function: Optional[HuggingFaceEmbeddings] = None
+
+# HNSW graph settings that can only be chosen when the collection is first created.
+# The space stays "l2": embeddings are normalized, so it ranks identically to cosine
+# and the backend's distance thresholds keep their meaning.
+HNSW_COLLECTION_METADATA = {
+    "hnsw:space": "l2",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+}
+
+# HNSW settings ChromaDB can change on an existing collection, applied on every run:
+# get_or_create_collection ignores the settings of a collection that already exists.
+# Inserts are buffered and added to the graph 1000 at a time.
+HNSW_RUNTIME_CONFIGURATION = {
+    "ef_search": 64,
+    "batch_size": 1000,
+    "sync_threshold": 1000,
+}
+
+# While a run stores its chunks, the graph is persisted only every this many vectors,
+# instead of after every 1000; the normal threshold is restored afterwards
+HNSW_BULK_SYNC_THRESHOLD = 100_000
+
+# Structural headers: "Section X:", or a number like "1.", "2.", etc. at the very start of a
+# loaded document. Without re.MULTILINE, numbered list items inside the text do not split it.
+# Compiled once here instead of re-parsed for every document and every part.
+_HEADER_RE = re.compile(r"(Section \d+:|^\d+\.)")
+
+# Fallback splitter for header sections that are still larger than CHUNK_SIZE, built once
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=config.CHUNK_SIZE,
+    chunk_overlap=config.CHUNK_OVERLAP,
+    length_function=len
+)
+
+
+def select_embedding_device() -> str:
+    """Picks the fastest available device for the embedding model."""
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """
+    Return the process-wide embedding model, loading it on first use.
+    Runs where nothing changed, or every chunk is cached, never pay the model load at all.
+    """
+    global _embedding_function
+    if _embedding_function is None:
+        print(f"🤖 Loading embedding model: {config.EMBEDDING_MODEL_NAME}...")
+        device = select_embedding_device()
+        model_kwargs = {'device': device}
+        if device != 'cpu':
+            # Half-precision weights halve memory bandwidth on GPU; CPU stays in fp32
+            model_kwargs['model_kwargs'] = {'torch_dtype': torch.float16}
+        encode_kwargs = {
+            'normalize_embeddings': True,
+            'batch_size': ENCODE_BATCH_SIZES[device],
+            'convert_to_numpy': True
+        }
+
+        _embedding_function = HuggingFaceEmbeddings(
+            model_name=config.EMBEDDING_MODEL_NAME,
+            model_kwargs=model_kwargs,
+            encode_kwargs=encode_kwargs,
+            show_progress=True
+        )
+        print(f"  ✓ Embedding model loaded on '{device}'.")
+    return _embedding_function
+
 
 def init_db() -> sqlite3.Connection:
     """Initialize the SQLite database for tracking processed documents."""
     conn = sqlite3.connect(config.PROCESSED_DB_PATH)
+    # WAL with synchronous=NORMAL only fsyncs at checkpoints, not on every commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -47,31 +168,60 @@ def init_db() -> sqlite3.Connection:
             filepath TEXT PRIMARY KEY,
             last_modified REAL,
             content_hash TEXT,
-            processed_at REAL
+            processed_at REAL,
+            size INTEGER
         )
     """)
 
+    # Databases created before the size column existed get it added in place
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(processed_files)")}
+    if "size" not in columns:
+        cursor.execute("ALTER TABLE processed_files ADD COLUMN size INTEGER")
+
+    # Embeddings of already-seen chunk texts, keyed by chunk_content_hash and embedding model
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            chunk_hash TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            dtype TEXT NOT NULL DEFAULT 'float32',
+            PRIMARY KEY (chunk_hash, model_name)
+        )
+    """)
+
+    # Caches created before vectors were stored as float16 keep decoding their rows as float32
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(embedding_cache)")}
+    if "dtype" not in columns:
+        cursor.execute("ALTER TABLE embedding_cache ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+
     conn.commit()
     return conn
 
 
+def _new_hasher(multithreaded: bool = False):
+    """BLAKE3 (SIMD, optionally multi-threaded) when installed, otherwise SHA-256."""
+    if blake3 is not None:
+        return blake3.blake3(max_threads=blake3.blake3.AUTO if multithreaded else 1)
+    return hashlib.sha256()
+
+
 def get_file_hash(filepath: str) -> str:
     """Generate a hash of the file content."""
-    hash_md5 = hashlib.md5()
+    file_hash = _new_hasher(multithreaded=True)
     try:
         with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
+            for chunk in iter(lambda: f.read(HASH_READ_SIZE), b""):
+                file_hash.update(chunk)
     except FileNotFoundError:
         return "file_not_found"
-    return hash_md5.hexdigest()
+    return file_hash.hexdigest()
 
 
 def get_file_record(conn: sqlite3.Connection, filepath: str) -> Optional[Dict[str, Any]]:
     """Get the record of a processed file from the database."""
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT filepath, last_modified, content_hash FROM processed_files WHERE filepath = ?",
+        "SELECT filepath, last_modified, content_hash, size FROM processed_files WHERE filepath = ?",
         (filepath,)
     )
     result = cursor.fetchone()
@@ -80,29 +230,112 @@ def get_file_record(conn: sqlite3.Connection, filepath: str) -> Optional[Dict[st
         return {
             "filepath": result[0],
             "last_modified": result[1],
-            "content_hash": result[2]
+            "content_hash": result[2],
+            "size": result[3]
         }
     return None
 
 
-def update_file_record(conn: sqlite3.Connection, filepath: str, last_modified: float, content_hash: str):
-    """Update the record of a processed file in the database."""
+def update_file_records(conn: sqlite3.Connection, records: List[tuple]):
+    """Update many (filepath, last_modified, content_hash, size) records in one transaction."""
+    processed_at = datetime.now().timestamp()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO processed_files (filepath, last_modified, content_hash, processed_at)
-        VALUES (?, ?, ?, ?)
-    """, (filepath, last_modified, content_hash, datetime.now().timestamp()))
+    cursor.executemany("""
+        INSERT OR REPLACE INTO processed_files (filepath, last_modified, content_hash, processed_at, size)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(filepath, last_modified, content_hash, processed_at, size) for filepath, last_modified, content_hash, size in records])
     conn.commit()
 
 
+def get_cached_embeddings(conn: sqlite3.Connection, chunk_hashes: List[str]) -> Dict[str, List[float]]:
+    """Look up cached embeddings for the given chunk hashes under the configured model."""
+    embeddings = {}
+    cursor = conn.cursor()
+    for start in range(0, len(chunk_hashes), CACHE_LOOKUP_BATCH):
+        batch = chunk_hashes[start:start + CACHE_LOOKUP_BATCH]
+        placeholders = ",".join("?" * len(batch))
+        cursor.execute(
+            f"SELECT chunk_hash, embedding, dtype FROM embedding_cache WHERE model_name = ? AND chunk_hash IN ({placeholders})",
+            (config.EMBEDDING_MODEL_NAME, *batch)
+        )
+        embeddings.update(
+            (chunk_hash, np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist())
+            for chunk_hash, blob, dtype in cursor.fetchall()
+        )
+    return embeddings
+
+
+def store_cached_embeddings(conn: sqlite3.Connection, embeddings: Dict[str, np.ndarray]):
+    """Store chunk embeddings in the cache as EMBEDDING_CACHE_DTYPE blobs."""
+    dtype_name = np.dtype(EMBEDDING_CACHE_DTYPE).name
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT OR REPLACE INTO embedding_cache (chunk_hash, model_name, embedding, dtype) VALUES (?, ?, ?, ?)",
+        [(chunk_hash, config.EMBEDDING_MODEL_NAME, np.asarray(vector, dtype=EMBEDDING_CACHE_DTYPE).tobytes(), dtype_name)
+         for chunk_hash, vector in embeddings.items()]
+    )
+    conn.commit()
+
+
+def embed_chunks(conn: sqlite3.Connection, chunks: List[Document]) -> List[List[float]]:
+    """
+    Embed chunks, running the model only once per distinct text that is not cached yet.
+    Repeated boilerplate (headers, footers, disclaimers) is encoded a single time.
+    """
+    chunk_hashes = [chunk.metadata["chunk_content_hash"] for chunk in chunks]
+    embeddings = get_cached_embeddings(conn, list(dict.fromkeys(chunk_hashes)))
+
+    missing = {}
+    for chunk_hash, chunk in zip(chunk_hashes, chunks):
+        if chunk_hash not in embeddings:
+            missing.setdefault(chunk_hash, chunk.page_content)
+
+    if missing:
+        # Fresh vectors get the same rounding as cached ones, so a text always stores the same vector
+        vectors = np.asarray(get_embeddings().embed_documents(list(missing.values())), dtype=EMBEDDING_CACHE_DTYPE)
+        store_cached_embeddings(conn, dict(zip(missing, vectors)))
+        embeddings.update(zip(missing, vectors.astype(np.float32).tolist()))
+
+    return [embeddings[chunk_hash] for chunk_hash in chunk_hashes]
+
+
+def get_file_extension(filepath: str) -> str:
+    """Lower-cased extension of a path, same as Path(filepath).suffix.lower() without the Path object."""
+    return os.path.splitext(filepath)[1].lower()
+
+
+def scan_supported_files(root: str):
+    """
+    Recursively yield (filepath, last_modified, size) for every file with a supported extension.
+    Like os.walk, directories that cannot be listed are skipped instead of aborting the scan.
+    """
+    try:
+        entries = os.scandir(root)
+    except OSError as e:
+        logger.warning("Skipping unreadable directory %s: %s", root, e)
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_supported_files(entry.path)
+            elif entry.is_file():
+                if get_file_extension(entry.name) in SUPPORTED_EXTENSIONS:
+                    try:
+                        stat = entry.stat()
+                    except OSError as e:  # removed or made unreadable during the scan
+                        logger.warning("Skipping %s: %s", entry.path, e)
+                        continue
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+
 def get_loader(filepath: str):
     """Get the appropriate loader for a file based on its extension."""
-    file_ext = Path(filepath).suffix.lower()
+    file_ext = get_file_extension(filepath)
 
-    if file_ext not in config.SUPPORTED_FILE_TYPES:
+    loader_name = SUPPORTED_FILE_TYPES.get(file_ext)
+    if loader_name is None:
         raise ValueError(f"Unsupported file type: {file_ext}")
 
-    loader_name = config.SUPPORTED_FILE_TYPES[file_ext]
     loader_class = LOADER_MAPPING.get(loader_name)
 
     if not loader_class:
@@ -118,145 +351,182 @@ def get_loader(filepath: str):
         return loader_class(filepath)
 
 # --- FIX: New function for intelligent, header-based splitting ---
-def split_text_by_headers(documents: List[Document]) -> List[Document]:
+def split_text_by_headers(full_text: str) -> Iterator[str]:
     """
-    Splits document text based on structural headers.
+    Splits text based on structural headers.
     This is more effective than a fixed-size splitter for structured documents.
     """
-    new_chunks = []
-    # This regex looks for lines starting with "Section X:" or a number like "1.", "2.", etc.
-    # It will serve as our splitting point.
-    header_pattern = r"(Section \d+:|^\d+\.)"
+    # Each section runs from one header to the next; text before the first header is its own section.
+    # Slicing the original string once per section avoids re-gluing split tokens with +=.
+    boundaries = [0] + [match.start() for match in _HEADER_RE.finditer(full_text)] + [len(full_text)]
+
+    for start, end in zip(boundaries, boundaries[1:]):
+        text = full_text[start:end].strip()
+        if text:
+            yield text
+# --- End of new function ---
 
+
+def build_chunks(documents: List[Document], file_metadata: Dict[str, Any]) -> Iterator[Document]:
+    """
+    Split loaded documents into final chunks in a single pass.
+    Each chunk's metadata dict is built exactly once: the loader metadata, the file metadata
+    and the chunk's content hash.
+    """
     for doc in documents:
-        # Combine the page content if it's already split by the loader
-        full_text = doc.page_content
-        # Split the text based on the identified header pattern
-        # The re.split function can keep the delimiter, which is what we want.
-        # (.*?) is a non-greedy capture of the delimiter itself.
-        split_text = re.split(f'({header_pattern}.*)', full_text)
-
-        # The result of the split will be like: ['', 'Section 1: ...', 'content...', '', '2. ...', 'content...']
-        # We need to re-combine the delimiter with its following content.
-        temp_chunk = ""
-        for part in split_text:
-            if re.match(header_pattern, part):
-                # If we find a new header, the previous chunk is complete.
-                if temp_chunk.strip():
-                    new_chunks.append(Document(page_content=temp_chunk.strip(), metadata=doc.metadata.copy()))
-                # Start a new chunk with the new header
-                temp_chunk = part
-            else:
-                # Append the content to the current chunk
-                temp_chunk += part
-
-        # Add the last remaining chunk
-        if temp_chunk.strip():
-            new_chunks.append(Document(page_content=temp_chunk.strip(), metadata=doc.metadata.copy()))
-
-    return new_chunks
-# --- End of new function ---
+        base_metadata = {**doc.metadata, **file_metadata}
+        for section in split_text_by_headers(doc.page_content):
+            # As a fallback, sections that are still too large are split further by size
+            texts = TEXT_SPLITTER.split_text(section) if len(section) > config.CHUNK_SIZE else (section,)
+            for text in texts:
+                # Chunks are small, so stdlib BLAKE2b's low per-call setup cost beats a full hasher object,
+                # and the hash does not depend on whether blake3 is installed.
+                content_hash = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+                yield Document(page_content=text, metadata={**base_metadata, "chunk_content_hash": content_hash})
 
 
 def load_and_chunk_document(filepath: str) -> List[Document]:
     """Load a document and split it into chunks with metadata."""
     try:
-        file_path = Path(filepath)
-        file_name = file_path.name
-        file_type = file_path.suffix.lower()
-        last_modified = os.path.getmtime(filepath)
+        file_name = os.path.basename(filepath)
+        file_metadata = {
+            "source": str(filepath),
+            "last_modified": os.path.getmtime(filepath),
+            "file_type": get_file_extension(filepath),
+            "file_name": file_name
+        }
 
         loader = get_loader(filepath)
         documents = loader.load()
 
-        # Add base metadata to each document from the loader
-        for doc in documents:
-            doc.metadata.update({
-                "source": str(filepath),
-                "last_modified": last_modified,
-                "file_type": file_type,
-                "file_name": file_name
-            })
-
-        # --- FIX: Use the new header-based splitting strategy ---
-        chunks = split_text_by_headers(documents)
-
-        # As a fallback, you can still split very large chunks if needed
-        final_chunks = []
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=config.CHUNK_SIZE, # This will now only apply to chunks that are still too large
-            chunk_overlap=config.CHUNK_OVERLAP,
-            length_function=len
-        )
-        for chunk in chunks:
-            if len(chunk.page_content) > config.CHUNK_SIZE:
-                # If a structurally-split chunk is still too big, split it further
-                sub_chunks = text_splitter.split_documents([chunk])
-                final_chunks.extend(sub_chunks)
-            else:
-                final_chunks.append(chunk)
-
-        # Add unique hash to each final chunk's metadata
-        for chunk in final_chunks:
-            chunk.metadata["chunk_content_hash"] = hashlib.md5(chunk.page_content.encode('utf-8')).hexdigest()
-        # --- End of fix ---
+        # --- FIX: Use the header-based splitting strategy ---
+        final_chunks = list(build_chunks(documents, file_metadata))
 
-
-        print(f"  ✓ Loaded {len(documents)} document(s) and created {len(final_chunks)} chunks using header-based strategy.")
+        logger.debug("Loaded %d document(s) from %s and created %d chunks using header-based strategy.", len(documents), file_name, len(final_chunks))
         return final_chunks
 
     except Exception as e:
-        print(f"  ✗ Error processing {filepath}: {str(e)}")
+        logger.error(f"Error processing {filepath}: {e}")
         return []
 
 
-def ingest_documents():
-    """Main function to ingest documents into ChromaDB."""
-    print("🚀 Starting document ingestion pipeline...")
+def find_changed_files(conn: sqlite3.Connection, scanned_files: List[tuple]) -> Tuple[List[tuple], int]:
+    """
+    Compares scanned (filepath, last_modified, size) entries against the tracking database.
+    Returns the (filepath, last_modified, content_hash, size) entries that need ingesting
+    and the number of unchanged files skipped.
+    """
+    files_to_process: List[tuple] = []
+    refreshed_records: List[tuple] = []  # unchanged files whose tracking row needs updating
+    skipped_count = 0
 
-    print("📊 Initializing tracking database...")
-    conn = init_db()
+    print(f"\nChecking {len(scanned_files)} files for changes...")
+    for filepath, last_modified, size in tqdm(scanned_files, desc="Checking documents"):
+        try:
+            record = get_file_record(conn, filepath)
 
-    print(f"🤖 Loading embedding model: {config.EMBEDDING_MODEL_NAME}...")
-    model_kwargs = {'device': 'cpu'}
-    encode_kwargs = {'normalize_embeddings': True}
+            # Fast path: unchanged mtime and size means unchanged file, no need to read and hash it
+            if record and record["last_modified"] == last_modified and record["size"] == size:
+                skipped_count += 1
+                continue
 
-    embedding_function = HuggingFaceEmbeddings(
-        model_name=config.EMBEDDING_MODEL_NAME,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs
-    )
-    print("  ✓ Embedding model loaded.")
+            content_hash = get_file_hash(filepath)
+            if record and record["content_hash"] == content_hash:
+                # Same content under a new mtime (touch, copy) or a row predating the size column:
+                # refresh the row so the fast path applies next run, without re-embedding
+                refreshed_records.append((filepath, last_modified, content_hash, size))
+                skipped_count += 1
+                continue
 
-    print("🗄️  Initializing ChromaDB client...")
-    db_client = chromadb.PersistentClient(path=str(config.CHROMA_PERSIST_DIR))
+            files_to_process.append((filepath, last_modified, content_hash, size))
 
-    vector_db = Chroma(
-        client=db_client,
-        collection_name=config.CHROMA_COLLECTION_NAME,
-        embedding_function=embedding_function,
-        persist_directory=str(config.CHROMA_PERSIST_DIR)
-    )
-    print(f"  ✓ ChromaDB collection '{config.CHROMA_COLLECTION_NAME}' ready.")
+        except Exception as e:
+            tqdm.write(f"  ✗ Error processing {filepath}: {str(e)}")
+            continue
 
-    if not config.REFERENCE_DOCS_DIR.exists():
-        print(f"  ✗ Reference docs directory not found: {config.REFERENCE_DOCS_DIR}")
-        return
+    if refreshed_records:
+        update_file_records(conn, refreshed_records)
 
-    print("🔍 Scanning for documents...")
-    supported_files = []
-    for root, _, files in os.walk(config.REFERENCE_DOCS_DIR):
-        for file in files:
-            filepath = os.path.join(root, file)
-            file_ext = Path(filepath).suffix.lower()
-            if file_ext in config.SUPPORTED_FILE_TYPES:
-                supported_files.append(filepath)
-    print(f"  ✓ Found {len(supported_files)} supported files")
+    return files_to_process, skipped_count
+
+
+def _init_loader_process():
+    """
+    Turns tokenizer parallelism off in forked loader workers. With the variable set explicitly,
+    the tokenizer no longer disables itself after a fork, and a thread pool inherited from a
+    parent that already tokenized could deadlock if a worker ever tokenized.
+    """
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def load_changed_files(files_to_process: List[tuple]) -> Tuple[List[Document], List[str], List[tuple]]:
+    """
+    Loads and chunks changed files in a process pool.
+    Returns the chunks, their ids and the tracking records of the files that produced them.
+    Must run while no SQLite connection or ChromaDB client is open: the workers are forked.
+    """
+    pending_chunks: List[Document] = []
+    pending_ids: List[str] = []
+    pending_records: List[tuple] = []
+    if not files_to_process:
+        return pending_chunks, pending_ids, pending_records
+
+    # Parsing (pdfminer, unstructured, ...) is CPU-bound Python, so changed files are loaded
+    # and chunked in worker processes.
+    print(f"\nProcessing {len(files_to_process)} changed files...")
+    max_workers = min(os.cpu_count() or 1, len(files_to_process))
+    loaded: List[tuple] = []  # (file_entry, chunks)
+    broken_pool_entries: List[tuple] = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_loader_process) as executor:
+        futures = [executor.submit(load_and_chunk_document, entry[0]) for entry in files_to_process]
+        for file_entry, future in tqdm(zip(files_to_process, futures), total=len(futures), desc="Ingesting documents"):
+            try:
+                loaded.append((file_entry, future.result()))
+            except BrokenProcessPool:
+                # A worker died (segfault, OOM kill) and took every pending file down with it
+                broken_pool_entries.append(file_entry)
+            except Exception as e:
+                # e.g. a result that failed to pickle: only this file is lost
+                tqdm.write(f"  ✗ Error processing {file_entry[0]}: {str(e)}")
+
+    if broken_pool_entries:
+        # Retry each affected file in its own process, so only the file that crashes the loader is lost
+        tqdm.write(f"  ⚠️  Loader process crashed; retrying {len(broken_pool_entries)} files one at a time...")
+        for file_entry in broken_pool_entries:
+            try:
+                with ProcessPoolExecutor(max_workers=1, initializer=_init_loader_process) as executor:
+                    loaded.append((file_entry, executor.submit(load_and_chunk_document, file_entry[0]).result()))
+            except Exception as e:
+                tqdm.write(f"  ✗ Error processing {file_entry[0]}: {str(e)}")
+
+    for file_entry, chunks in loaded:
+        filepath = file_entry[0]
+        if not chunks:
+            tqdm.write(f"  ⚠️  No chunks created for {os.path.basename(filepath)}")
+            continue
+
+        file_id = hashlib.sha256(filepath.encode()).hexdigest()
+        chunk_ids = [f"{file_id}_{i}" for i in range(len(chunks))]
+
+        pending_chunks.extend(chunks)
+        pending_ids.extend(chunk_ids)
+        pending_records.append(file_entry)
+        logger.debug("Chunked %s (%d chunks)", os.path.basename(filepath), len(chunks))
+
+    return pending_chunks, pending_ids, pending_records
+
+
+def apply_hnsw_configuration(collection, **overrides):
+    """Applies HNSW_RUNTIME_CONFIGURATION, with any overrides, to an existing collection."""
+    try:
+        collection.modify(configuration={"hnsw": {**HNSW_RUNTIME_CONFIGURATION, **overrides}})
+    except Exception as e:
+        # ChromaDB before 1.0 cannot change HNSW settings after creation
+        print(f"  ⚠️  Could not update HNSW settings: {str(e)}")
 
-    if not supported_files:
-        print("  ℹ️  No supported files found to process")
-        return
 
+def delete_removed_documents(conn: sqlite3.Connection, collection, supported_files: List[str]):
+    """Deletes the chunks and tracking rows of tracked files that are no longer on disk."""
     print("\n🧹 Checking for deleted documents to remove from DB...")
     current_files_on_disk = set(supported_files)
     cursor = conn.cursor()
@@ -266,50 +536,99 @@ def ingest_documents():
 
     if files_to_delete_from_db:
         print(f"  🗑️ Deleting data for {len(files_to_delete_from_db)} removed documents from ChromaDB...")
-        # Placeholder for delete logic
-        print("  (Deletion logic would go here)")
+        try:
+            # One metadata-filtered delete keeps orphaned vectors out of the HNSW graph
+            collection.delete(where={"source": {"$in": list(files_to_delete_from_db)}})
+            cursor.executemany(
+                "DELETE FROM processed_files WHERE filepath = ?",
+                [(filepath,) for filepath in files_to_delete_from_db]
+            )
+            conn.commit()
+            print(f"  ✓ Removed {len(files_to_delete_from_db)} documents.")
+        except Exception as e:
+            print(f"  ✗ Error deleting removed documents: {str(e)}")
     else:
         print("  No documents found for deletion.")
 
-    processed_count = 0
-    skipped_count = 0
-    total_chunks_processed = 0
 
-    print(f"\nProcessing {len(supported_files)} files...")
-    for filepath in tqdm(supported_files, desc="Ingesting documents"):
-        try:
-            last_modified = os.path.getmtime(filepath)
-            content_hash = get_file_hash(filepath)
-            record = get_file_record(conn, filepath)
+def ingest_documents():
+    """Main function to ingest documents into ChromaDB."""
+    print("🚀 Starting document ingestion pipeline...")
 
-            if record and record["last_modified"] == last_modified and record["content_hash"] == content_hash:
-                skipped_count += 1
-                continue
+    if not config.REFERENCE_DOCS_DIR.exists():
+        print(f"  ✗ Reference docs directory not found: {config.REFERENCE_DOCS_DIR}")
+        return
 
-            print(f"  📄 Processing {os.path.basename(filepath)}...")
-            chunks = load_and_chunk_document(filepath)
-            if not chunks:
-                print(f"  ⚠️  No chunks created for {os.path.basename(filepath)}")
-                continue
+    print("🔍 Scanning for documents...")
+    # The scan already stats each entry, so mtime and size come along for the change check
+    scanned_files = list(scan_supported_files(str(config.REFERENCE_DOCS_DIR)))
+    supported_files = [filepath for filepath, _, _ in scanned_files]
+    print(f"  ✓ Found {len(supported_files)} supported files")
+    if not supported_files:
+        print("  ℹ️  No supported files found to process")
 
-            chunk_ids = [
-                f"{hashlib.sha256(filepath.encode()).hexdigest()}_{i}"
-                for i, _ in enumerate(chunks)
-            ]
-            
-            vector_db.add_documents(
-                documents=chunks,
-                ids=chunk_ids
-            )
+    print("📊 Initializing tracking database...")
+    conn = init_db()
+    try:
+        files_to_process, skipped_count = find_changed_files(conn, scanned_files)
+    finally:
+        conn.close()
 
-            update_file_record(conn, filepath, last_modified, content_hash)
-            print(f"  ✅ Successfully processed {os.path.basename(filepath)} ({len(chunks)} chunks)")
-            processed_count += 1
-            total_chunks_processed += len(chunks)
+    # Phase 1 collects the chunks of every changed file; phase 2 embeds them in large batches.
+    # The loader pool forks, so it runs before the tracking database and ChromaDB are (re)opened.
+    pending_chunks, pending_ids, pending_records = load_changed_files(files_to_process)
 
-        except Exception as e:
-            print(f"  ✗ Error processing {filepath}: {str(e)}")
-            continue
+    processed_count = 0
+    total_chunks_processed = 0
+
+    conn = init_db()
+    try:
+        print("🗄️  Initializing ChromaDB client...")
+        db_client = chromadb.PersistentClient(path=str(config.CHROMA_PERSIST_DIR))
+
+        # Vectors are always computed here and passed in, so the collection gets no embedding function
+        collection = db_client.get_or_create_collection(
+            name=config.CHROMA_COLLECTION_NAME,
+            metadata=HNSW_COLLECTION_METADATA,
+            embedding_function=None
+        )
+        print(f"  ✓ ChromaDB collection '{config.CHROMA_COLLECTION_NAME}' ready.")
+
+        # Runs even when no supported files are left, so their chunks do not linger
+        delete_removed_documents(conn, collection, supported_files)
+
+        if pending_chunks:
+            print(f"\n🧮 Embedding {len(pending_chunks)} chunks...")
+            try:
+                # One encode call over every uncached text keeps the encoder at full batch size throughout
+                embeddings = embed_chunks(conn, pending_chunks)
+
+                # Drop every old chunk of the changed files first: ids are {file}_{i}, so a file that now
+                # yields fewer chunks would otherwise keep its old tail ids as stale duplicates
+                collection.delete(where={"source": {"$in": [record[0] for record in pending_records]}})
+
+                apply_hnsw_configuration(collection, sync_threshold=HNSW_BULK_SYNC_THRESHOLD)
+                upsert_batch = min(UPSERT_BATCH, db_client.get_max_batch_size())
+                for start in tqdm(range(0, len(pending_chunks), upsert_batch), desc="Storing chunks"):
+                    batch = pending_chunks[start:start + upsert_batch]
+                    collection.upsert(
+                        ids=pending_ids[start:start + upsert_batch],
+                        embeddings=embeddings[start:start + upsert_batch],
+                        documents=[chunk.page_content for chunk in batch],
+                        metadatas=[chunk.metadata for chunk in batch]
+                    )
+                # Files are only marked processed once all of their chunks are stored
+                update_file_records(conn, pending_records)
+                processed_count = len(pending_records)
+                total_chunks_processed = len(pending_chunks)
+            except Exception as e:
+                print(f"  ✗ Error storing chunks in ChromaDB: {str(e)}")
+
+        # Restores the normal sync threshold after a bulk store, and brings a collection
+        # created with older settings up to date even when nothing changed
+        apply_hnsw_configuration(collection)
+    finally:
+        conn.close()
 
     print("\n📊 Ingestion Summary:")
     print(f"  • Total files found in folder: {len(supported_files)}")
@@ -319,7 +638,6 @@ def ingest_documents():
     print(f"  • ChromaDB Collection: {config.CHROMA_COLLECTION_NAME}")
     print(f"  • ChromaDB location: {config.CHROMA_PERSIST_DIR}")
 
-    conn.close()
     print("🎉 Document ingestion completed!")
 
 